@@ -3,12 +3,38 @@
 import numpy as np
 import warnings
 from astropy.constants import c
+from concurrent.futures import ThreadPoolExecutor
 from pyuvdata import UVBeam
 from scipy.interpolate import RectBivariateSpline
+from scipy.linalg.blas import cherk, zherk
 from typing import Optional, Sequence
 
 from . import conversions
 
+try:
+    import numba as nb
+
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+try:
+    import cupy as cp
+
+    HAVE_CUPY = True
+except ImportError:
+    HAVE_CUPY = False
+
+# Target size (in bytes) of each block of complex voltages, chosen so that a block
+# fits in a typical L2 cache, and the minimum number of sources in a block (so that
+# the visibility products do not become too inefficient for large arrays).
+SOURCE_BLOCK_BYTES = 2**20
+MIN_SOURCE_BLOCK = 256
+
+# Target size (in bytes) of each block of complex voltages when using a GPU, which
+# bounds the device memory used for any number of sources.
+GPU_SOURCE_BLOCK_BYTES = 2**28
+
 # This enables us to put in profile decorators that will be no-ops if no profiling
 # library is being used.
 try:
@@ -68,6 +94,256 @@ def construct_pixel_beam_spline(bm_cube):
     return splines
 
 
+def _unique_beams(beam_list, beam_idx):
+    """Remove repeated beam objects from a list of beams.
+
+    Parameters
+    ----------
+    beam_list : list of UVBeam
+        List of beams, possibly containing the same object more than once.
+    beam_idx : array_like
+        Index into ``beam_list`` of the beam to use for each antenna.
+
+    Returns
+    -------
+    beam_list : list of UVBeam
+        List of unique beam objects, in order of first appearance.
+    beam_idx : array_like
+        Index into the new ``beam_list`` of the beam to use for each antenna.
+    """
+    unique = {}
+    for bm in beam_list:
+        unique.setdefault(id(bm), (len(unique), bm))
+
+    if len(unique) == len(beam_list):
+        return beam_list, beam_idx
+
+    new_idx = np.array([unique[id(bm)][0] for bm in beam_list])
+    return [bm for _, bm in unique.values()], new_idx[beam_idx]
+
+
+def _beam_interp_function(bm, freq):
+    """Construct a function that evaluates a beam at a single frequency.
+
+    For ``UVBeam`` objects on an az/za grid, the interpolating splines are built
+    once here (in the same way as the ``az_za_simple`` interpolation function of
+    ``UVBeam.interp``), so that evaluating the beam does not pass through the
+    ``UVBeam.interp`` machinery every time. Other beams use their ``interp`` method.
+
+    Parameters
+    ----------
+    bm : UVBeam or AnalyticBeam
+        Beam object, which has already been interpolated to ``freq`` if it is a
+        ``UVBeam``.
+    freq : float
+        Frequency to evaluate the beam at [Hz].
+
+    Returns
+    -------
+    beam_fn : fn
+        Function ``beam_fn(az, za)`` returning the beam values at the given
+        azimuth and zenith angles, with shape (NAXES_VEC, NFEEDS or NPOLS, NSRCS).
+    """
+    if (
+        not isinstance(bm, UVBeam)
+        or bm.pixel_coordinate_system != "az_za"
+        or (
+            bm.basis_vector_array is not None
+            and (
+                np.any(bm.basis_vector_array[0, 1] > 0)
+                or np.any(bm.basis_vector_array[1, 0] > 0)
+            )
+        )
+    ):
+        kw = (
+            {"reuse_spline": True, "check_azza_domain": False}
+            if isinstance(bm, UVBeam)
+            else {}
+        )
+
+        def beam_fn(az, za):
+            return bm.interp(
+                az_array=az, za_array=za, freq_array=np.atleast_1d(freq), **kw
+            )[0][:, 0, :, 0, :]
+
+        return beam_fn
+
+    az_grid, za_grid = bm.axis1_array, bm.axis2_array
+    data = bm.data_array.reshape((bm.Naxes_vec, -1, za_grid.size, az_grid.size))
+
+    # If the azimuth wraps around, extend the grid in each direction to improve
+    # the interpolation.
+    daz = az_grid[1] - az_grid[0]
+    if np.isclose(np.abs(az_grid[0] - az_grid[-1]) + daz, 2 * np.pi, atol=daz):
+        nwrap = 3
+        az_grid = np.concatenate(
+            (
+                np.flip(-az_grid[:nwrap] - daz),
+                az_grid,
+                az_grid[-nwrap:] + nwrap * daz,
+            )
+        )
+        data = np.concatenate((data[..., -nwrap:], data, data[..., :nwrap]), axis=-1)
+
+    parts = [data.real, data.imag] if np.iscomplexobj(data) else [data]
+    splines = [
+        [
+            [RectBivariateSpline(za_grid, az_grid, part[i, j]) for part in parts]
+            for j in range(data.shape[1])
+        ]
+        for i in range(data.shape[0])
+    ]
+    dtype = data.dtype if np.iscomplexobj(data) else np.float64
+
+    def beam_fn(az, za):
+        out = np.empty(data.shape[:2] + az.shape, dtype=dtype)
+        for i, spl_axis in enumerate(splines):
+            for j, spl in enumerate(spl_axis):
+                out[i, j] = spl[0](za, az, grid=False)
+                if len(spl) > 1:
+                    out[i, j] += 1j * spl[1](za, az, grid=False)
+        return out
+
+    return beam_fn
+
+
+def _compute_voltages_numpy(
+    A_s, antpos_over_c, crd_top, isqrt, ang_freq, beam_idx, out, work=None
+):
+    """Compute the complex voltage of each antenna/feed for each source.
+
+    Parameters
+    ----------
+    A_s : array_like
+        Beam values for each unique beam. Shape=(NAX, NFEED, NBEAMS, NSRCS_UP).
+    antpos_over_c : array_like
+        Antenna positions divided by the speed of light [s]. Shape=(NANT, 3).
+    crd_top : array_like
+        Topocentric (ENU) unit vectors of sources above the horizon.
+        Shape=(3, NSRCS_UP).
+    isqrt : array_like
+        Square root of the per-polarization intensity of each source above the
+        horizon. Shape=(NSRCS_UP,).
+    ang_freq : float
+        Angular frequency, ``2 pi freq``.
+    beam_idx : array_like
+        Index of the beam to use for each antenna. Shape=(NANT,).
+    out : array_like
+        Output array of complex voltages, filled in-place.
+        Shape=(NFEED * NANT, NAX * NSRCS_UP).
+    work : tuple of array_like, optional
+        Flat real and complex scratch buffers (with the precision of ``out``) for
+        the phases and phase factors, each of at least NANT * NSRCS_UP elements. If
+        not given, they are allocated here.
+    """
+    nax, nfeed, _, nsrcs_up = A_s.shape
+    nant = antpos_over_c.shape[0]
+
+    if work is None:
+        work = (
+            np.empty(nant * nsrcs_up, dtype=out.real.dtype),
+            np.empty(nant * nsrcs_up, dtype=out.dtype),
+        )
+    phase = work[0][: nant * nsrcs_up].reshape((nant, nsrcs_up))
+    v = work[1][: nant * nsrcs_up].reshape((nant, nsrcs_up))
+
+    # Calculate delays, where tau = (b * s) / c, and turn them into phases
+    # in-place.
+    np.dot(antpos_over_c, crd_top, out=phase)
+    phase *= ang_freq
+
+    # Component of complex phase factor for one antenna
+    # (actually, b = (antpos1 - antpos2) * crd_top / c; need dot product
+    # below to build full phase factor for a given baseline). The real and
+    # imaginary parts are written directly, to avoid complex temporaries.
+    np.cos(phase, out=v.real)
+    np.sin(phase, out=v.imag)
+
+    # Complex voltages.
+    v *= isqrt
+
+    # Input arrays have shape (Nax, Nfeed, [Nants], Nsrcs), which we write into
+    # the output, viewed as (Nfeed, Nants, Nax, Nsrcs). If there is only a single
+    # beam, it is broadcast over antennas rather than copied for each of them.
+    if A_s.shape[2] != 1:
+        A_s = A_s[:, :, beam_idx]
+
+    np.multiply(
+        A_s.transpose((1, 2, 0, 3)),
+        v[np.newaxis, :, np.newaxis, :],
+        out=out.reshape((nfeed, nant, nax, nsrcs_up)),
+    )
+
+
+if HAVE_NUMBA:
+
+    def _compute_voltages_kernel(
+        A_s, antpos_over_c, crd_top, isqrt, ang_freq, beam_idx, out
+    ):
+        """Compute the complex voltages in a single fused pass over the sources.
+
+        See :func:`_compute_voltages_numpy` for a description of the parameters.
+        """
+        nax, nfeed, _, nsrcs_up = A_s.shape
+        nant = antpos_over_c.shape[0]
+
+        for ia in nb.prange(nant):
+            ib = beam_idx[ia]
+
+            # Phase factor times sqrt intensity for this antenna. This is written
+            # in terms of real cos/sin (rather than a complex exp) in a simple
+            # loop over sources, so that it can be SIMD-vectorized.
+            v = np.empty(nsrcs_up, dtype=out.dtype)
+            for n in range(nsrcs_up):
+                phase = ang_freq * (
+                    antpos_over_c[ia, 0] * crd_top[0, n]
+                    + antpos_over_c[ia, 1] * crd_top[1, n]
+                    + antpos_over_c[ia, 2] * crd_top[2, n]
+                )
+                v[n] = complex(np.cos(phase) * isqrt[n], np.sin(phase) * isqrt[n])
+
+            for p2 in range(nfeed):
+                for p1 in range(nax):
+                    row = p2 * nant + ia
+                    col = p1 * nsrcs_up
+                    for n in range(nsrcs_up):
+                        out[row, col + n] = A_s[p1, p2, ib, n] * v[n]
+
+    # The parallel kernel is used by default. The serial kernel releases the GIL
+    # instead, and is used when time steps are themselves run in parallel threads
+    # (numba's default threading layer does not support concurrent launches).
+    _compute_voltages_numba = nb.njit(parallel=True, fastmath=True, cache=True)(
+        _compute_voltages_kernel
+    )
+    _compute_voltages_serial = nb.njit(nogil=True, fastmath=True)(
+        _compute_voltages_kernel
+    )
+    _compute_voltages = _compute_voltages_numba
+else:
+    _compute_voltages = _compute_voltages_serial = _compute_voltages_numpy
+
+
+def _compute_voltages_cupy(A_s, antpos_over_c, crd_top, isqrt, ang_freq, beam_idx, out):
+    """Compute the complex voltages on the GPU.
+
+    See :func:`_compute_voltages_numpy` for a description of the parameters,
+    all of which (apart from ``ang_freq``) must be ``cupy`` arrays.
+    """
+    nax, nfeed, _, nsrcs_up = A_s.shape
+    nant = antpos_over_c.shape[0]
+
+    phase = cp.dot(antpos_over_c, crd_top)
+    phase *= ang_freq
+    v = cp.exp(1j * phase).astype(out.dtype, copy=False)
+    v *= isqrt
+
+    cp.multiply(
+        A_s[:, :, beam_idx].transpose((1, 2, 0, 3)),
+        v[cp.newaxis, :, cp.newaxis, :],
+        out=out.reshape((nfeed, nant, nax, nsrcs_up)),
+    )
+
+
 @profile
 def vis_cpu(
     antpos: np.ndarray,
@@ -80,6 +356,8 @@ def vis_cpu(
     precision: int = 1,
     polarized: bool = False,
     beam_idx: Optional[np.ndarray] = None,
+    nthreads: int = 1,
+    use_gpu: bool = False,
 ):
     """
     Calculate visibility from an input intensity map and beam model.
@@ -137,6 +415,23 @@ def vis_cpu(
         Optional length-NANT array specifying a beam index for each antenna.
         By default, either a single beam is assumed to apply to all antennas or
         each antenna gets its own beam.
+    nthreads : int, optional
+        Number of threads over which to distribute the time samples. If greater
+        than one, each thread simulates a contiguous block of times, and the
+        compiled voltage kernel (if ``numba`` is installed) runs serially within
+        each thread. In this case you may want to limit the number of threads used
+        by BLAS (e.g. with ``OMP_NUM_THREADS``) to avoid over-subscription. Each
+        thread allocates its own beam and voltage buffers (the beam buffer holds
+        NAX * NFEED * NBEAMS * NSRCS complex values), so their memory use grows
+        with the number of threads. No more than NTIMES threads are used.
+        Default: 1.
+    use_gpu : bool, optional
+        Whether to compute the complex voltages and their products on a GPU,
+        using ``cupy`` (which must be installed). The coordinate rotations and beam
+        evaluation are still done on the CPU. Sources are processed in blocks of
+        about ``GPU_SOURCE_BLOCK_BYTES`` of voltages, which bounds the GPU memory
+        used. This is only worthwhile for large numbers of sources and antennas.
+        Default: False.
 
     Returns
     -------
@@ -146,12 +441,20 @@ def vis_cpu(
         shape (NTIMES, NANTS, NANTS).
     """
     assert precision in {1, 2}
+    assert (
+        isinstance(nthreads, (int, np.integer)) and nthreads >= 1
+    ), "nthreads must be a positive integer."
+    if use_gpu and not HAVE_CUPY:
+        raise ImportError("You need to install cupy to use use_gpu=True!")
+
     if precision == 1:
         real_dtype = np.float32
         complex_dtype = np.complex64
+        herk = cherk
     else:
         real_dtype = np.float64
         complex_dtype = np.complex128
+        herk = zherk
 
     # Specify number of polarizations (axes/feeds)
     if polarized:
@@ -206,6 +509,11 @@ def vis_cpu(
         ), "beam_idx contains indices greater than the number of beams"
 
     if beam_list is not None:
+        # Antennas often share the same beam object, so only evaluate each unique
+        # beam once.
+        beam_list, beam_idx = _unique_beams(beam_list, beam_idx)
+        nbeam = len(beam_list)
+
         # make sure we interpolate to the right frequency first.
         beam_list = [
             bm.interp(freq_array=np.array([freq]), new_object=True, run_check=False)
@@ -213,6 +521,7 @@ def vis_cpu(
             else bm
             for bm in beam_list
         ]
+        beam_fns = [_beam_interp_function(bm, freq) for bm in beam_list]
 
     if beam_list is None:
         bm_pix = bm_cube.shape[-1]
@@ -247,105 +556,224 @@ def vis_cpu(
 
     # Intensity distribution (sqrt) and antenna positions. Does not support
     # negative sky. Factor of 0.5 accounts for splitting Stokes I between
-    # polarization channels
-    Isqrt = np.sqrt(0.5 * I_sky).astype(real_dtype)
-    antpos = antpos.astype(real_dtype)
-
-    ang_freq = 2.0 * np.pi * freq
-
-    # Zero arrays: beam pattern, visibilities, delays, complex voltages
-    vis = np.zeros((nfeed, nfeed, ntimes, nant, nant), dtype=complex_dtype)
-    crd_eq = crd_eq.astype(real_dtype)
+    # polarization channels. Antenna positions are divided by the speed of light
+    # once here, so that the delays need no further scaling inside the time loop.
+    Isqrt = np.sqrt(0.5 * I_sky).astype(real_dtype, copy=False)
+    antpos_over_c = (antpos / c.value).astype(real_dtype, copy=False)
+
+    # Keep the coordinates and frequency at the requested precision, so that the
+    # products inside the time loop are never silently up-cast.
+    crd_eq = crd_eq.astype(real_dtype, copy=False)
+    eq2tops = eq2tops.astype(real_dtype, copy=False)
+    ang_freq = real_dtype(2.0 * np.pi * freq)
+
+    # Zero arrays: visibilities.
+    vis = np.zeros((ntimes, nfeed * nant, nfeed * nant), dtype=complex_dtype)
+    lower = np.tril_indices(nfeed * nant, -1)
+    # There is no point in having more threads (each with its own buffers) than
+    # time samples.
+    nthreads = max(1, min(nthreads, ntimes))
+    compute_voltages = _compute_voltages if nthreads == 1 else _compute_voltages_serial
+
+    # Number of sources per block of complex voltages.
+    nsrcs_block = max(
+        MIN_SOURCE_BLOCK,
+        SOURCE_BLOCK_BYTES // (nfeed * nant * nax * np.dtype(complex_dtype).itemsize),
+    )
+    nsrcs_block = min(nsrcs_block, nsrcs)
+
+    # Arrays that are the same at every time step only need to be copied to the
+    # GPU once. The GPU uses larger blocks of sources, whose voltages are kept on
+    # the device.
+    if use_gpu:
+        antpos_over_c_gpu = cp.asarray(antpos_over_c)
+        beam_idx_gpu = cp.asarray(beam_idx)
+        nsrcs_block_gpu = max(
+            MIN_SOURCE_BLOCK,
+            GPU_SOURCE_BLOCK_BYTES
+            // (nfeed * nant * nax * np.dtype(complex_dtype).itemsize),
+        )
+        nsrcs_block_gpu = min(nsrcs_block_gpu, nsrcs)
 
-    # Precompute splines using pixelized beams
+    # Stack the pixelized beams for all polarizations and beams along a single
+    # axis, so that they can all be interpolated at once. Pixel coordinates are
+    # found by (linearly) interpolating the l,m grid, which is not uniformly spaced.
     if beam_list is None:
-        splines_re = construct_pixel_beam_spline(bm_cube.real)
-        if complex_bm_cube:
-            splines_im = construct_pixel_beam_spline(bm_cube.imag)
-
-    im = 0
-
-    # Loop over time samples
-    for t, eq2top in enumerate(eq2tops.astype(real_dtype)):
-        # Dot product converts ECI cosines (i.e. from RA and Dec) into ENU
-        # (topocentric) cosines, with (tx, ty, tz) = (e, n, u) components
-        # relative to the center of the array
-        tx, ty, tz = crd_top = np.dot(eq2top, crd_eq)
-        above_horizon = tz > 0
-        tx = tx[above_horizon]
-        ty = ty[above_horizon]
-        nsrcs_up = len(tx)
-
-        A_s = np.zeros((nax, nfeed, nbeam, nsrcs_up), dtype=complex_dtype)
-        tau = np.zeros((nant, nsrcs_up), dtype=real_dtype)
-        v = np.zeros((nant, nsrcs_up), dtype=complex_dtype)
-
-        # Primary beam response
-        if beam_list is None:
-            # Primary beam pattern using pixelized primary beam
-            for i in range(nbeam):
-                # Extract requested polarizations
-                for p1 in range(nax):
-                    for p2 in range(nfeed):
-                        # The beam pixel grid has been reshaped in the order
-                        # ty,tx, which implies m,l order
-
-                        re = splines_re[p1][p2][i](ty, tx, grid=False)
-
-                        if complex_bm_cube:
-                            im = 1.0j * splines_im[p1][p2][i](ty, tx, grid=False)
+        bm_stack = (
+            (bm_cube if complex_bm_cube else bm_cube.real)
+            .reshape((nax * nfeed * nbeam, bm_pix, bm_pix))
+            .astype(complex_dtype if complex_bm_cube else real_dtype, copy=False)
+        )
+        bm_lm = conversions.bm_pix_to_lm(bm_pix)
+        bm_pix_idx = np.arange(bm_pix)
+
+        # Linear interpolation of finite values is always finite, so invalid beam
+        # values only need to be checked for once.
+        if not np.isfinite(bm_stack).all():
+            raise ValueError("bm_cube contains an invalid value")
+
+    def _simulate_times(times):
+        # Buffers for the beam pattern and complex voltages are allocated once
+        # (per thread), large enough for all sources to be above the horizon, and
+        # re-used (as contiguous views of the right size) at each time step.
+        vis_t = np.zeros((nfeed * nant, nfeed * nant), dtype=complex_dtype, order="F")
+        A_s_buf = np.empty(nax * nfeed * nbeam * nsrcs, dtype=complex_dtype)
+        v_buf = np.empty(nfeed * nant * nax * nsrcs_block, dtype=complex_dtype)
+        if use_gpu:
+            v_buf_gpu = cp.empty(
+                nfeed * nant * nax * nsrcs_block_gpu, dtype=complex_dtype
+            )
 
-                        A_s[p1, p2, i] = re + im
+        # The NumPy voltage calculation also needs scratch space for the phases (the
+        # compiled kernel does not).
+        if compute_voltages is _compute_voltages_numpy:
+            work = {
+                "work": (
+                    np.empty(nant * nsrcs_block, dtype=real_dtype),
+                    np.empty(nant * nsrcs_block, dtype=complex_dtype),
+                )
+            }
         else:
-
-            # Primary beam pattern using direct interpolation of UVBeam object
-            az, za = conversions.enu_to_az_za(enu_e=tx, enu_n=ty, orientation="uvbeam")
-            for i, bm in enumerate(beam_list):
-                kw = (
-                    {"reuse_spline": True, "check_azza_domain": False}
-                    if isinstance(bm, UVBeam)
-                    else {}
+            work = {}
+
+        # Loop over time samples
+        for t in times:
+            eq2top = eq2tops[t]
+
+            # Only keep sources above the horizon; everything else contributes
+            # nothing, so there is no point evaluating beams or phases for them. The
+            # up (tz) component alone decides this, so find it before doing the
+            # full rotation.
+            above_horizon = np.dot(eq2top[2], crd_eq) > 0
+            isqrt = Isqrt[above_horizon]
+
+            # Dot product converts ECI cosines (i.e. from RA and Dec) into ENU
+            # (topocentric) cosines, with (tx, ty, tz) = (e, n, u) components
+            # relative to the center of the array
+            crd_top = np.dot(eq2top, crd_eq[:, above_horizon])
+            tx, ty, tz = crd_top
+            nsrcs_up = len(tx)
+            if nsrcs_up == 0:
+                # No sources above the horizon, so the visibilities are zero.
+                continue
+
+            A_s = A_s_buf[: nax * nfeed * nbeam * nsrcs_up].reshape(
+                (nax, nfeed, nbeam, nsrcs_up)
+            )
+            # Primary beam response
+            if beam_list is None:
+                # Primary beam pattern using pixelized primary beam. The beam pixel
+                # grid has been reshaped in the order ty,tx, which implies m,l order.
+                # The fractional pixel coordinates, and hence the bilinear
+                # interpolation weights, are the same for every beam, so compute them
+                # once and apply them to the whole stack of beams at once.
+                py = np.interp(ty, bm_lm, bm_pix_idx)
+                px = np.interp(tx, bm_lm, bm_pix_idx)
+                iy = np.clip(py.astype(int), 0, bm_pix - 2)
+                ix = np.clip(px.astype(int), 0, bm_pix - 2)
+                fy = (py - iy).astype(real_dtype, copy=False)
+                fx = (px - ix).astype(real_dtype, copy=False)
+
+                A_s[:] = (
+                    (bm_stack[:, iy, ix] * (1 - fx) + bm_stack[:, iy, ix + 1] * fx)
+                    * (1 - fy)
+                    + (
+                        bm_stack[:, iy + 1, ix] * (1 - fx)
+                        + bm_stack[:, iy + 1, ix + 1] * fx
+                    )
+                    * fy
+                ).reshape((nax, nfeed, nbeam, nsrcs_up))
+            else:
+
+                # Primary beam pattern using direct interpolation of UVBeam object
+                az, za = conversions.enu_to_az_za(
+                    enu_e=tx, enu_n=ty, orientation="uvbeam"
+                )
+                for i, beam_fn in enumerate(beam_fns):
+                    interp_beam = beam_fn(az, za)
+
+                    if polarized:
+                        A_s[:, :, i] = interp_beam
+                    else:
+                        # Here we have already asserted that the beam is a power
+                        # beam and has only one polarization, so we just evaluate
+                        # that one.
+                        A_s[:, :, i] = np.sqrt(interp_beam[0, 0])
+
+                # Check for invalid beam values
+                if not np.isfinite(A_s).all():
+                    raise ValueError("Beam interpolation resulted in an invalid value")
+
+            if use_gpu:
+                # Voltages are computed for one block of sources at a time, and their
+                # products accumulated on the device, so that the memory used on the
+                # GPU does not grow with the number of sources.
+                crd_top_gpu = cp.asarray(crd_top)
+                isqrt_gpu = cp.asarray(isqrt)
+                vis_t_gpu = cp.zeros((nfeed * nant, nfeed * nant), dtype=complex_dtype)
+                for s0 in range(0, nsrcs_up, nsrcs_block_gpu):
+                    blk = slice(s0, s0 + nsrcs_block_gpu)
+                    nblk = min(nsrcs_block_gpu, nsrcs_up - s0)
+                    v = v_buf_gpu[: nfeed * nant * nax * nblk].reshape(
+                        (nfeed * nant, nax * nblk)
+                    )
+                    _compute_voltages_cupy(
+                        cp.asarray(np.ascontiguousarray(A_s[..., blk])),
+                        antpos_over_c_gpu,
+                        crd_top_gpu[:, blk],
+                        isqrt_gpu[blk],
+                        ang_freq,
+                        beam_idx_gpu,
+                        v,
+                    )
+                    vis_t_gpu += v.conj() @ v.T
+                vis[t] = cp.asnumpy(vis_t_gpu)
+                continue
+
+            # Compute visibilities using product of complex voltages. A single matrix
+            # product takes the outer product over feeds/antennas, contracts over
+            # E-field components, and integrates over the sky. The product is
+            # Hermitian, so only its upper triangle is computed (note that v.T is
+            # Fortran-ordered, so is passed to BLAS without a copy), and the lower
+            # triangle is filled in by conjugation. Sources are processed in
+            # blocks, accumulating into vis_t, so that each block of voltages is
+            # still in cache when it is used in the product.
+            for s0 in range(0, nsrcs_up, nsrcs_block):
+                blk = slice(s0, s0 + nsrcs_block)
+                nblk = min(nsrcs_block, nsrcs_up - s0)
+                v = v_buf[: nfeed * nant * nax * nblk].reshape(
+                    (nfeed * nant, nax * nblk)
                 )
 
-                interp_beam = bm.interp(
-                    az_array=az, za_array=za, freq_array=np.atleast_1d(freq), **kw
-                )[0]
-
-                if polarized:
-                    interp_beam = interp_beam[:, 0, :, 0, :]
-                else:
-                    # Here we have already asserted that the beam is a power beam and
-                    # has only one polarization, so we just evaluate that one.
-                    interp_beam = np.sqrt(interp_beam[0, 0, 0, 0, :])
-
-                A_s[:, :, i] = interp_beam
-
-        # Check for invalid beam values
-        if np.any(np.isinf(A_s)) or np.any(np.isnan(A_s)):
-            raise ValueError("Beam interpolation resulted in an invalid value")
-
-        # Calculate delays, where tau = (b * s) / c
-        np.dot(antpos, crd_top[:, above_horizon], out=tau)
-        tau /= c.value
-
-        # Component of complex phase factor for one antenna
-        # (actually, b = (antpos1 - antpos2) * crd_top / c; need dot product
-        # below to build full phase factor for a given baseline)
-        np.exp(1.0j * (ang_freq * tau), out=v)
-
-        # Complex voltages.
-        v *= Isqrt[above_horizon]
+                # Complex voltages for each feed/antenna and E-field component.
+                compute_voltages(
+                    A_s[..., blk],
+                    antpos_over_c,
+                    crd_top[:, blk],
+                    isqrt[blk],
+                    ang_freq,
+                    beam_idx,
+                    v,
+                    **work,
+                )
+                vis_t = herk(
+                    1.0, v.T, beta=float(s0 > 0), c=vis_t, trans=2, overwrite_c=1
+                )
+            vis[t] = vis_t
+            vis[t][lower] = vis_t.T[lower].conj()
 
-        # Compute visibilities using product of complex voltages (upper triangle).
-        # Input arrays have shape (Nax, Nfeed, [Nants], Nsrcs
-        v = A_s[:, :, beam_idx] * v[np.newaxis, np.newaxis, :]
+    # Time steps are independent, so blocks of them can be simulated in
+    # parallel. NumPy, BLAS and the serial numba kernel all release the GIL.
+    if nthreads == 1:
+        _simulate_times(range(ntimes))
+    else:
+        with ThreadPoolExecutor(nthreads) as pool:
+            chunks = np.array_split(range(ntimes), nthreads)
+            list(pool.map(_simulate_times, [times for times in chunks if len(times)]))
 
-        for i in range(len(antpos)):
-            # We want to take an outer product over feeds/antennas, contract over
-            # E-field components, and integrate over the sky.
-            vis[:, :, t, i : i + 1, i:] = np.einsum(
-                "jiln,jkmn->iklm", v[:, :, i : i + 1].conj(), v[:, :, i:], optimize=True
-            )
+    # Return visibilities with or without multiple polarization channels. Without
+    # polarization, vis already has the right (contiguous) shape.
+    if not polarized:
+        return vis
 
-    # Return visibilities with or without multiple polarization channels
-    return vis if polarized else vis[0, 0]
+    return vis.reshape((ntimes, nfeed, nant, nfeed, nant)).transpose((1, 3, 0, 2, 4))
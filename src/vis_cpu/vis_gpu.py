@@ -196,12 +196,13 @@ def vis_gpu(
     assert beams.shape == (nant, beam_px, beam_px)
     ntimes = eq2tops.shape[0]
     assert eq2tops.shape == (ntimes, 3, 3)
-    # ensure data types
-    antpos = antpos.astype(real_dtype)
-    eq2tops = eq2tops.astype(real_dtype)
-    crd_eq = crd_eq.astype(real_dtype)
-    Isqrt = np.sqrt(sky_flux).astype(real_dtype)
-    beams = beams.astype(real_dtype)  # XXX complex?
+    # ensure data types (and C-contiguity, for copying to the GPU), without
+    # copying inputs that already match
+    antpos = np.ascontiguousarray(antpos, dtype=real_dtype)
+    eq2tops = np.ascontiguousarray(eq2tops, dtype=real_dtype)
+    crd_eq = np.ascontiguousarray(crd_eq, dtype=real_dtype)
+    Isqrt = np.sqrt(sky_flux).astype(real_dtype, copy=False)
+    beams = np.ascontiguousarray(beams, dtype=real_dtype)  # XXX complex?
     chunk = max(
         min(npix, MIN_CHUNK),
         2 ** int(np.ceil(np.log2(float(nant * npix) / max_memory / 2))),
@@ -3,6 +3,7 @@ import numpy as np
 from pyuvdata.uvbeam import UVBeam
 
 from . import conversions, vis_cpu
+from .vis_cpu import _unique_beams
 
 
 def simulate_vis(
@@ -102,6 +103,10 @@ def simulate_vis(
     # Get coordinate transforms as a function of LST
     eq2tops = np.array([conversions.eci_to_enu_matrix(lst, latitude) for lst in lsts])
 
+    # Antennas often share the same beam object, so only convert (and simulate)
+    # each distinct beam once.
+    beams, beam_idx = _unique_beams(beams, np.arange(len(beams)))
+
     # Create beam pixel models (if requested)
     if pixel_beams:
         beam_pix = [
@@ -130,8 +135,12 @@ def simulate_vis(
 
         if pixel_beams:
 
-            # Get per-freq. pixel beam
-            bm = beam_cube[:, :, :, i, :, :] if polarized else beam_cube[:, i, :, :]
+            # Get per-freq. pixel beam. For polarized beams, vis_cpu expects the
+            # beam axis to come after the axes and feeds.
+            if polarized:
+                bm = np.moveaxis(beam_cube[:, :, :, i, :, :], 0, 2)
+            else:
+                bm = beam_cube[:, i, :, :]
 
             # Run vis_cpu
             v = vis_cpu(
@@ -143,6 +152,7 @@ def simulate_vis(
                 bm_cube=bm,
                 precision=precision,
                 polarized=polarized,
+                beam_idx=beam_idx,
             )
             if polarized:
                 vis[:, :, i] = v  # v.shape: (nax, nfeed, ntimes, nant, nant)
@@ -158,6 +168,7 @@ def simulate_vis(
                 beam_list=beams,
                 precision=precision,
                 polarized=polarized,
+                beam_idx=beam_idx,
             )
             if polarized:
                 vis[:, :, i] = v  # v.shape: (nax, nfeed, ntimes, nant, nant)
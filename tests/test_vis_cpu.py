@@ -1,12 +1,24 @@
 """Tests of vis_cpu."""
 import pytest
 
+import importlib
 import numpy as np
+import types
+import warnings
+from astropy.constants import c
 from astropy.units import sday
+from pathlib import Path
+from pyuvdata import UVBeam
 from pyuvsim.analyticbeam import AnalyticBeam
 
 from vis_cpu import conversions, simulate_vis, vis_cpu
-from vis_cpu.vis_cpu import construct_pixel_beam_spline
+from vis_cpu.vis_cpu import (
+    HAVE_CUPY,
+    _beam_interp_function,
+    _compute_voltages,
+    _compute_voltages_numpy,
+    construct_pixel_beam_spline,
+)
 
 np.random.seed(0)
 NTIMES = 10
@@ -14,6 +26,7 @@ NFREQ = 5
 NPTSRC = 20
 
 ants = {0: (0.0, 0.0, 0.0), 1: (20.0, 20.0, 0.0)}
+beam_file = Path(__file__).parent / "data/NF_HERA_Dipole_small.fits"
 
 
 def test_vis_cpu():
@@ -102,6 +115,59 @@ def test_vis_cpu():
         )
     assert np.all(~np.isnan(_vis))  # check that there are no NaN values
 
+    # Check that a complex-typed pixel beam with no imaginary part is treated as
+    # real, without discarding the imaginary part with a warning
+    with warnings.catch_warnings():
+        warnings.filterwarnings("error", message="Casting complex values")
+        for precision in (1, 2):
+            _vis = vis_cpu(
+                antpos,
+                freq[0],
+                eq2tops,
+                crd_eq,
+                I_sky[:, 0],
+                bm_cube=beam_cube[:, 0, :, :].astype(np.complex128),
+                precision=precision,
+                polarized=False,
+            )
+            assert np.all(~np.isnan(_vis))
+
+    # Check that invalid beam values raise an error
+    with pytest.raises(ValueError, match="invalid value"):
+        vis_cpu(
+            antpos,
+            freq[0],
+            eq2tops,
+            crd_eq,
+            I_sky[:, 0],
+            bm_cube=np.full_like(beam_cube[:, 0], np.nan),
+            precision=1,
+            polarized=False,
+        )
+
+    # ... including when they come from evaluating a beam object
+    class NaNBeam(AnalyticBeam):
+        """Power beam that evaluates to NaN."""
+
+        def interp(self, az_array, za_array, freq_array, **kwargs):
+            interp_data, interp_basis_vector = super().interp(
+                az_array, za_array, freq_array, **kwargs
+            )
+            return np.full_like(interp_data, np.nan), interp_basis_vector
+
+    nan_beam = conversions.prepare_beam(NaNBeam("gaussian", diameter=14.0))
+    with pytest.raises(ValueError, match="invalid value"):
+        vis_cpu(
+            antpos,
+            freq[0],
+            eq2tops,
+            crd_eq,
+            I_sky[:, 0],
+            beam_list=[nan_beam],
+            precision=1,
+            polarized=False,
+        )
+
     # Check that errors are raised when beams are input incorrectly
     with pytest.raises(RuntimeError):
         vis_cpu(
@@ -170,6 +236,13 @@ def test_simulate_vis(pixel_beams, polarized):
     )
     assert np.all(~np.isnan(vis))  # check that there are no NaN values
 
+    # Check that the visibility matrix is Hermitian in the antenna axes
+    if polarized:
+        vis_h = np.swapaxes(vis, 0, 1)
+    else:
+        vis_h = vis
+    assert np.allclose(vis, np.swapaxes(vis_h, -1, -2).conj())
+
 
 def test_construct_pixel_beam_spline():
     """Test pixel beam interpolation."""
@@ -197,3 +270,310 @@ def test_construct_pixel_beam_spline():
     assert len(beam_splines_pol) == 1
     assert len(beam_splines_pol[0]) == 1
     assert len(beam_splines_pol[0][0]) == len(beams)
+
+
+@pytest.mark.parametrize("nbeam", [1, 2])
+@pytest.mark.parametrize("polarized", [False, True])
+@pytest.mark.parametrize("precision", [1, 2])
+def test_compute_voltages(polarized, precision, nbeam):
+    """Test that the compiled voltage kernel matches the NumPy implementation."""
+    real_dtype, complex_dtype = {
+        1: (np.float32, np.complex64),
+        2: (np.float64, np.complex128),
+    }[precision]
+    nax = nfeed = 2 if polarized else 1
+    nant, nsrcs = 4, 30
+
+    antpos_over_c = (np.random.uniform(-20.0, 20.0, (nant, 3)) / c.value).astype(
+        real_dtype
+    )
+    crd_top = np.random.uniform(-1.0, 1.0, (3, nsrcs)).astype(real_dtype)
+    isqrt = np.random.uniform(0.0, 1.0, nsrcs).astype(real_dtype)
+    A_s = np.random.uniform(0.0, 1.0, (nax, nfeed, nbeam, nsrcs)).astype(complex_dtype)
+    beam_idx = np.array([0, 1, 1, 0]) if nbeam == 2 else np.zeros(nant, dtype=int)
+    ang_freq = 2.0 * np.pi * 150.0e6
+
+    v_np = np.empty((nfeed * nant, nax * nsrcs), dtype=complex_dtype)
+    v = np.empty_like(v_np)
+    _compute_voltages_numpy(
+        A_s, antpos_over_c, crd_top, isqrt, ang_freq, beam_idx, v_np
+    )
+    _compute_voltages(A_s, antpos_over_c, crd_top, isqrt, ang_freq, beam_idx, v)
+
+    assert np.allclose(v, v_np, rtol=1e-4 if precision == 1 else 1e-10)
+
+    # Pre-allocated (over-sized) scratch buffers give the same result
+    work = (
+        np.empty(2 * nant * nsrcs, dtype=real_dtype),
+        np.empty(2 * nant * nsrcs, dtype=complex_dtype),
+    )
+    _compute_voltages_numpy(
+        A_s, antpos_over_c, crd_top, isqrt, ang_freq, beam_idx, v, work=work
+    )
+    assert np.array_equal(v, v_np)
+
+
+def test_vis_cpu_no_sources_above_horizon():
+    """Test that visibilities are zero when no sources are above the horizon."""
+    antpos = np.array([ants[k] for k in ants.keys()])
+    hera_lat = -30.7215 * np.pi / 180.0
+    eq2tops = np.array([conversions.eci_to_enu_matrix(0.0, lat=hera_lat)])
+
+    # Sources near the north celestial pole never rise at the HERA latitude
+    ra = np.linspace(0.0, 2.0 * np.pi, NPTSRC)
+    dec = np.full(NPTSRC, 0.45 * np.pi)
+    crd_eq = conversions.point_source_crd_eq(ra, dec)
+
+    beam = AnalyticBeam("gaussian", diameter=14.0)
+    vis = vis_cpu(
+        antpos,
+        100.0e6,
+        eq2tops,
+        crd_eq,
+        np.ones(NPTSRC),
+        beam_list=[conversions.prepare_beam(beam, polarized=False)],
+        precision=2,
+        polarized=False,
+    )
+    assert vis.shape == (1, len(ants), len(ants))
+    assert np.all(vis == 0)
+
+
+@pytest.mark.parametrize("precision", [1, 2])
+def test_vis_cpu_direct_sum(precision):
+    """Test that vis_cpu agrees with a direct sum over sources."""
+    antpos = np.random.uniform(-50.0, 50.0, (4, 3))
+    ra = np.linspace(0.0, 2.0 * np.pi, NPTSRC)
+    dec = np.linspace(-0.5 * np.pi, 0.5 * np.pi, NPTSRC)
+    crd_eq = conversions.point_source_crd_eq(ra, dec)
+    I_sky = np.random.uniform(1.0, 2.0, NPTSRC)
+    hera_lat = -30.7215 * np.pi / 180.0
+    lsts = np.linspace(0.0, 2.0 * np.pi, NTIMES)
+    eq2tops = np.array(
+        [conversions.eci_to_enu_matrix(lst, lat=hera_lat) for lst in lsts]
+    )
+    freq = 100.0e6
+
+    beam = AnalyticBeam("uniform")
+    vis = vis_cpu(
+        antpos,
+        freq,
+        eq2tops,
+        crd_eq,
+        I_sky,
+        beam_list=[conversions.prepare_beam(beam, polarized=False)],
+        precision=precision,
+    )
+
+    # With a uniform beam, the voltages are just the phases times sqrt(I/2)
+    for t, eq2top in enumerate(eq2tops):
+        crd_top = eq2top @ crd_eq
+        up = crd_top[2] > 0
+        tau = antpos @ crd_top[:, up] / c.value
+        v = np.exp(2j * np.pi * freq * tau) * np.sqrt(0.5 * I_sky[up])
+        assert np.allclose(
+            vis[t], v.conj() @ v.T, rtol=1e-4 if precision == 1 else 1e-10
+        )
+
+
+@pytest.mark.parametrize("pixel_beams", [True, False])
+def test_vis_cpu_nthreads(pixel_beams):
+    """Test that simulating time samples in parallel threads gives the same result."""
+    antpos = np.array([ants[k] for k in ants.keys()])
+    ra = np.linspace(0.0, 2.0 * np.pi, NPTSRC)
+    dec = np.linspace(-0.5 * np.pi, 0.5 * np.pi, NPTSRC)
+    crd_eq = conversions.point_source_crd_eq(ra, dec)
+    hera_lat = -30.7215 * np.pi / 180.0
+    lsts = np.linspace(0.0, 2.0 * np.pi, NTIMES)
+    eq2tops = np.array(
+        [conversions.eci_to_enu_matrix(lst, lat=hera_lat) for lst in lsts]
+    )
+
+    beam = AnalyticBeam("gaussian", diameter=14.0)
+    if pixel_beams:
+        freqs = np.array([100.0e6])
+        beam_pix = conversions.uvbeam_to_lm(beam, freqs, n_pix_lm=63)
+        kw = {"bm_cube": beam_pix[np.newaxis, 0]}
+    else:
+        kw = {"beam_list": [conversions.prepare_beam(beam, polarized=False)]}
+
+    vis1, vis3 = (
+        vis_cpu(
+            antpos,
+            100.0e6,
+            eq2tops,
+            crd_eq,
+            np.ones(NPTSRC),
+            precision=2,
+            nthreads=nthreads,
+            **kw,
+        )
+        for nthreads in (1, 3)
+    )
+    assert np.allclose(vis1, vis3)
+
+    # More threads than time samples
+    vis_many = vis_cpu(
+        antpos,
+        100.0e6,
+        eq2tops,
+        crd_eq,
+        np.ones(NPTSRC),
+        precision=2,
+        nthreads=NTIMES + 5,
+        **kw,
+    )
+    assert np.allclose(vis1, vis_many)
+
+    for nthreads in (0, -1, 1.5):
+        with pytest.raises(AssertionError, match="nthreads"):
+            vis_cpu(
+                antpos,
+                100.0e6,
+                eq2tops,
+                crd_eq,
+                np.ones(NPTSRC),
+                nthreads=nthreads,
+                **kw,
+            )
+
+
+def test_vis_cpu_use_gpu():
+    """Test the GPU voltages, or that they cannot be used without cupy."""
+    antpos = np.array([ants[k] for k in ants.keys()])
+    ra = np.linspace(0.0, 2.0 * np.pi, NPTSRC)
+    dec = np.linspace(-0.5 * np.pi, 0.5 * np.pi, NPTSRC)
+    crd_eq = conversions.point_source_crd_eq(ra, dec)
+    hera_lat = -30.7215 * np.pi / 180.0
+    lsts = np.linspace(0.0, 2.0 * np.pi, NTIMES)
+    eq2tops = np.array(
+        [conversions.eci_to_enu_matrix(lst, lat=hera_lat) for lst in lsts]
+    )
+    beam = AnalyticBeam("gaussian", diameter=14.0)
+    args = (antpos, 100.0e6, eq2tops, crd_eq, np.ones(NPTSRC))
+    kw = {"beam_list": [conversions.prepare_beam(beam, polarized=False)]}
+
+    if not HAVE_CUPY:
+        with pytest.raises(ImportError):
+            vis_cpu(*args, use_gpu=True, **kw)
+        return
+
+    vis_gpu = vis_cpu(*args, precision=2, use_gpu=True, **kw)
+    assert np.allclose(vis_gpu, vis_cpu(*args, precision=2, **kw))
+
+
+@pytest.mark.parametrize("polarized", [True, False])
+def test_vis_cpu_use_gpu_source_blocks(monkeypatch, polarized):
+    """Test the blocked GPU code path, using NumPy in place of cupy."""
+    antpos = np.array([ants[k] for k in ants.keys()])
+    ra = np.linspace(0.0, 2.0 * np.pi, NPTSRC)
+    dec = np.linspace(-0.5 * np.pi, 0.5 * np.pi, NPTSRC)
+    crd_eq = conversions.point_source_crd_eq(ra, dec)
+    hera_lat = -30.7215 * np.pi / 180.0
+    lsts = np.linspace(0.0, 2.0 * np.pi, NTIMES)
+    eq2tops = np.array(
+        [conversions.eci_to_enu_matrix(lst, lat=hera_lat) for lst in lsts]
+    )
+    beam = AnalyticBeam("gaussian", diameter=14.0)
+    args = (antpos, 100.0e6, eq2tops, crd_eq, np.ones(NPTSRC))
+    kw = {
+        "beam_list": [conversions.prepare_beam(beam, polarized=polarized)],
+        "polarized": polarized,
+        "precision": 2,
+    }
+    vis = vis_cpu(*args, **kw)
+
+    fake_cupy = types.SimpleNamespace(
+        asarray=np.asarray,
+        asnumpy=np.asarray,
+        dot=np.dot,
+        empty=np.empty,
+        exp=np.exp,
+        multiply=np.multiply,
+        newaxis=np.newaxis,
+        zeros=np.zeros,
+    )
+    module = importlib.import_module("vis_cpu.vis_cpu")
+    monkeypatch.setattr(module, "HAVE_CUPY", True)
+    monkeypatch.setattr(module, "cp", fake_cupy, raising=False)
+    monkeypatch.setattr(module, "MIN_SOURCE_BLOCK", 3)
+    monkeypatch.setattr(module, "GPU_SOURCE_BLOCK_BYTES", 1)
+
+    assert np.allclose(vis_cpu(*args, use_gpu=True, **kw), vis)
+
+
+@pytest.mark.parametrize("polarized", [True, False])
+def test_beam_interp_function(polarized):
+    """Test that the pre-built beam interpolation agrees with UVBeam.interp."""
+    freq = 100.0e6
+    beam = UVBeam()
+    beam.read_beamfits(beam_file)
+    if not polarized:
+        beam.efield_to_power(calc_cross_pols=False, inplace=True)
+        beam.select(polarizations=["xx"], inplace=True)
+    beam = beam.interp(freq_array=np.array([freq]), new_object=True, run_check=False)
+
+    az = np.random.uniform(0.0, 2.0 * np.pi, NPTSRC)
+    za = np.random.uniform(0.0, 0.5 * np.pi, NPTSRC)
+    interp_beam = beam.interp(az_array=az, za_array=za, freq_array=np.array([freq]))
+
+    beam_fn = _beam_interp_function(beam, freq)
+    assert np.allclose(beam_fn(az, za), interp_beam[0][:, 0, :, 0, :])
+
+
+def test_vis_cpu_source_blocks(monkeypatch):
+    """Test that splitting the sources into blocks gives the same result."""
+    antpos = np.array([ants[k] for k in ants.keys()])
+    ra = np.linspace(0.0, 2.0 * np.pi, NPTSRC)
+    dec = np.linspace(-0.5 * np.pi, 0.5 * np.pi, NPTSRC)
+    crd_eq = conversions.point_source_crd_eq(ra, dec)
+    hera_lat = -30.7215 * np.pi / 180.0
+    lsts = np.linspace(0.0, 2.0 * np.pi, NTIMES)
+    eq2tops = np.array(
+        [conversions.eci_to_enu_matrix(lst, lat=hera_lat) for lst in lsts]
+    )
+    beam = AnalyticBeam("gaussian", diameter=14.0)
+    beam_list = [conversions.prepare_beam(beam, polarized=True)]
+
+    kw = {"beam_list": beam_list, "precision": 2, "polarized": True}
+    vis = vis_cpu(antpos, 100.0e6, eq2tops, crd_eq, np.ones(NPTSRC), **kw)
+
+    # Use blocks of three sources, so that most time steps need several blocks.
+    module = importlib.import_module("vis_cpu.vis_cpu")
+    monkeypatch.setattr(module, "MIN_SOURCE_BLOCK", 3)
+    monkeypatch.setattr(module, "SOURCE_BLOCK_BYTES", 1)
+    vis_blocks = vis_cpu(antpos, 100.0e6, eq2tops, crd_eq, np.ones(NPTSRC), **kw)
+
+    assert np.allclose(vis, vis_blocks)
+
+
+@pytest.mark.parametrize("nthreads", [1, 2])
+def test_vis_cpu_numpy_voltages(monkeypatch, nthreads):
+    """Test that the NumPy voltages, with re-used scratch buffers, agree."""
+    antpos = np.array([ants[k] for k in ants.keys()])
+    ra = np.linspace(0.0, 2.0 * np.pi, NPTSRC)
+    dec = np.linspace(-0.5 * np.pi, 0.5 * np.pi, NPTSRC)
+    crd_eq = conversions.point_source_crd_eq(ra, dec)
+    hera_lat = -30.7215 * np.pi / 180.0
+    lsts = np.linspace(0.0, 2.0 * np.pi, NTIMES)
+    eq2tops = np.array(
+        [conversions.eci_to_enu_matrix(lst, lat=hera_lat) for lst in lsts]
+    )
+    beam = AnalyticBeam("gaussian", diameter=14.0)
+    beam_list = [conversions.prepare_beam(beam, polarized=True)]
+
+    kw = {"beam_list": beam_list, "precision": 2, "polarized": True}
+    vis = vis_cpu(antpos, 100.0e6, eq2tops, crd_eq, np.ones(NPTSRC), **kw)
+
+    # Use the NumPy voltages with blocks of three sources, so that the scratch
+    # buffers are re-used for blocks of different sizes.
+    module = importlib.import_module("vis_cpu.vis_cpu")
+    monkeypatch.setattr(module, "_compute_voltages", _compute_voltages_numpy)
+    monkeypatch.setattr(module, "_compute_voltages_serial", _compute_voltages_numpy)
+    monkeypatch.setattr(module, "MIN_SOURCE_BLOCK", 3)
+    monkeypatch.setattr(module, "SOURCE_BLOCK_BYTES", 1)
+    vis_numpy = vis_cpu(
+        antpos, 100.0e6, eq2tops, crd_eq, np.ones(NPTSRC), nthreads=nthreads, **kw
+    )
+
+    assert np.allclose(vis, vis_numpy)